@@ -20,3 +20,9 @@ FRONTEND_URL: str = _get_env_var("FRONTEND_URL", required=False)
 EXCHANGE_NAME = _get_env_var("EXCHANGE_NAME", "unicon")
 TASK_QUEUE_NAME = _get_env_var("WORK_QUEUE_NAME", "unicon.tasks")
 RESULT_QUEUE_NAME = _get_env_var("RESULT_QUEUE_NAME", "unicon.results")
+RESULT_QUEUE_PREFETCH_COUNT = int(_get_env_var("RESULT_QUEUE_PREFETCH_COUNT", "100"))
+# Log AMQP callbacks that block the event loop for longer than this many seconds (e.g. "0.05")
+_amqp_slow_callback_duration = _get_env_var("AMQP_SLOW_CALLBACK_DURATION", required=False)
+AMQP_SLOW_CALLBACK_DURATION: float | None = (
+    float(_amqp_slow_callback_duration) if _amqp_slow_callback_duration else None
+)
@@ -1,8 +1,12 @@
+import hashlib
+import json
+from collections import OrderedDict
 from functools import cached_property
 from logging import getLogger
+from threading import Lock
 from typing import Any, Literal, Self, cast
 
-from pydantic import BaseModel, RootModel, model_validator
+from pydantic import BaseModel, ConfigDict, RootModel, TypeAdapter, model_validator
 
 from unicon_backend.evaluator.tasks import Task, TaskEvalResult, TaskEvalStatus, TaskType
 from unicon_backend.evaluator.tasks.programming.artifact import File, PrimitiveData
@@ -22,20 +26,48 @@ logger = getLogger(__name__)
 
 USER_INPUT_STEP_ID: int = 0
 
+# NOTE: Tasks are validated afresh for every submission, so assembled programs are cached by the signatures of
+# the testcase and the user inputs instead of on the testcase itself.
+ASSEMBLED_PROGRAM_CACHE_SIZE: int = 512
+_assembled_program_cache: OrderedDict[tuple[bytes, bytes], str] = OrderedDict()
+_assembled_program_cache_lock = Lock()
+
 
 class Testcase(ComputeGraph):
     id: int
 
     @model_validator(mode="after")
     def check_exactly_one_output_step(self) -> Self:
-        num_output_steps: int = len([node for node in self.nodes if node.type == StepType.OUTPUT])
+        num_output_steps: int = len([node for node in self.nodes if node.type is StepType.OUTPUT])
         if num_output_steps != 1:
             raise ValueError(f"Expected exactly 1 output step, found {num_output_steps}")
         return self
 
     @cached_property
     def output_step(self) -> OutputStep:
-        return cast(OutputStep, next(node for node in self.nodes if node.type == StepType.OUTPUT))
+        return cast(OutputStep, next(node for node in self.nodes if node.type is StepType.OUTPUT))
+
+    @cached_property
+    def signature(self) -> bytes:
+        """Return a digest of the structure of the testcase, excluding the user input step"""
+        digest = hashlib.blake2b(digest_size=16)
+        for node in self.nodes:
+            if node.id != USER_INPUT_STEP_ID:
+                digest.update(node.model_dump_json().encode())
+        for edge in self.edges:
+            digest.update(edge.model_dump_json().encode())
+        return digest.digest()
+
+    @cached_property
+    def graph_files(self) -> list[File]:
+        """Return the files defined by the input steps of the testcase, excluding the user input step"""
+        return [
+            output.data
+            for node in self.nodes
+            if node.type is StepType.INPUT and node.id != USER_INPUT_STEP_ID
+            for output in node.outputs
+            if isinstance(output.data, File)
+        ]
 
 
 class SocketResult(CustomSQLModel):
@@ -54,10 +86,15 @@ class TestcaseResult(ProgramResult):
 
 
 class RequiredInput(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: str
     data: PrimitiveData | File
 
 
+_runner_job_adapter = TypeAdapter(RunnerJob)
+
+
 class ProgrammingTask(Task[list[RequiredInput], JobId]):
     type: Literal[TaskType.PROGRAMMING]
     question: str
@@ -71,33 +108,72 @@ class ProgrammingTask(Task[list[RequiredInput], JobId]):
         This is so that we simply treat it as a node in the graph
         NOTE: We assume that the id of user inputs is always 0
         """
+        # NOTE: The user inputs are already validated, so their sockets are constructed without validation
         return InputStep(
             id=USER_INPUT_STEP_ID,
             inputs=[],
             outputs=[
-                StepSocket(id=str(user_input.id), data=user_input.data)
+                StepSocket.model_construct(id=user_input.id, data=user_input.data)
                 for user_input in user_inputs
             ],
             type=StepType.INPUT,
         )
 
+    def assemble_program(
+        self, testcase: Testcase, user_input_step: InputStep, user_inputs_signature: bytes
+    ) -> str:
+        """Return the code of the program that runs the testcase with the given user input step"""
+        cache_key = (testcase.signature, user_inputs_signature)
+        with _assembled_program_cache_lock:
+            if (assembled_code := _assembled_program_cache.get(cache_key)) is not None:
+                _assembled_program_cache.move_to_end(cache_key)
+                return assembled_code
+
+        assembled_code = mpi_sandbox(testcase.run(user_input_step)).code
+        with _assembled_program_cache_lock:
+            _assembled_program_cache[cache_key] = assembled_code
+            if len(_assembled_program_cache) > ASSEMBLED_PROGRAM_CACHE_SIZE:
+                _assembled_program_cache.popitem(last=False)
+        return assembled_code
+
     def run(self, user_inputs: list[RequiredInput]) -> TaskEvalResult[JobId]:
+        user_input_ids: set[str] = set()
+        user_input_files: list[File] = []
+        user_inputs_digest = hashlib.blake2b(digest_size=16)
+        for user_input in user_inputs:
+            user_input_ids.add(user_input.id)
+            # Assembly only reads the names of files, their contents are passed to the runner as is
+            if isinstance(user_input.data, File):
+                user_input_files.append(user_input.data)
+                signature_entry: tuple[str, str, PrimitiveData] = (
+                    user_input.id,
+                    "file",
+                    user_input.data.name,
+                )
+            else:
+                signature_entry = (user_input.id, "data", user_input.data)
+            user_inputs_digest.update(json.dumps(signature_entry).encode())
+        user_inputs_signature: bytes = user_inputs_digest.digest()
+
         # Check if all required inputs are provided
-        for required_input in self.required_inputs:
-            if not any(required_input.id == user_input.id for user_input in user_inputs):
-                raise ValueError(f"Required input {required_input.id} not provided")
+        missing_input_ids: list[str] = [
+            required_input.id
+            for required_input in self.required_inputs
+            if required_input.id not in user_input_ids
+        ]
+        if missing_input_ids:
+            raise ValueError(f"Required inputs {', '.join(missing_input_ids)} not provided")
+
+        user_input_step: InputStep = self.create_input_step(user_inputs)
 
         runner_programs: list[RunnerProgram] = []
         for testcase in self.testcases:
-            assembled_program = mpi_sandbox(testcase.run(self.create_input_step(user_inputs)))
-
-            logger.debug(f"Assembled Program:\n{assembled_program}")
+            assembled_code: str = self.assemble_program(
+                testcase, user_input_step, user_inputs_signature
+            )
+            logger.debug("Assembled Program:\n%s", assembled_code)
 
-            graph_files: list[File] = []
-            for node in filter(lambda node: node.type == StepType.INPUT, testcase.nodes):
-                graph_files.extend(
-                    output.data for output in node.outputs if isinstance(output.data, File)
-                )
+            graph_files: list[File] = [*testcase.graph_files, *user_input_files]
 
             runner_programs.append(
                 RunnerProgram(
@@ -107,13 +183,13 @@ class ProgrammingTask(Task[list[RequiredInput], JobId]):
                     # to let ComputeGraph derive all the files needed to run the testcase
                     files=[
                         *graph_files,
-                        File(name="__entrypoint.py", content=assembled_program.code),
+                        File(name="__entrypoint.py", content=assembled_code),
                     ],
                 )
             )
 
         runner_job = RunnerJob.create(runner_programs, self.environment)
-        task_publisher.publish(runner_job.model_dump_json(serialize_as_any=True))
+        task_publisher.publish(_runner_job_adapter.dump_json(runner_job, serialize_as_any=True))
 
         return TaskEvalResult(task_id=self.id, status=TaskEvalStatus.PENDING, result=runner_job.id)
 
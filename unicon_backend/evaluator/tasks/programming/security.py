@@ -56,13 +56,18 @@ def call_function_safe(file_name, function_name, allow_error, *args, **kwargs):
 """)
 
 
+SANDBOX_IMPORTS = cst.parse_statement("import importlib, multiprocessing, sys, json")
+
+MAIN_GUARD_TEST = cst.parse_expression("__name__ == '__main__'")
+
+
 def mpi_sandbox(program: cst.Module) -> cst.Module:
     return cst.Module(
         [
-            cst.parse_statement("import importlib, multiprocessing, sys, json"),
+            SANDBOX_IMPORTS,
             *WORKER_TEMPLATE.body,
             cst.If(
-                test=cst.parse_expression("__name__ == '__main__'"),
+                test=MAIN_GUARD_TEST,
                 body=cst.IndentedBlock(
                     [*ENTRYPOINT_TEMPLATE.body, *MPI_CLEANUP_TEMPLATE.body, *program.body]
                 ),
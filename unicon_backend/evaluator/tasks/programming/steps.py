@@ -1,22 +1,20 @@
 import abc
+import json
 import logging
-from collections import deque
-from collections.abc import MutableSequence, Sequence
+from collections import defaultdict
+from collections.abc import Iterable, MutableSequence, Sequence
+from collections.abc import Set as AbstractSet
 from enum import Enum, StrEnum
 from functools import cached_property
-from typing import TYPE_CHECKING, Any, ClassVar, Optional, Self
+from typing import Annotated, Any, ClassVar, Literal, Optional, Self
 
 import libcst as cst
-from pydantic import model_validator
+from pydantic import ConfigDict, Field, PrivateAttr, model_validator
 
 from unicon_backend.evaluator.tasks.programming.artifact import File, PrimitiveData
 from unicon_backend.evaluator.tasks.programming.transforms import hoist_imports
 from unicon_backend.lib.common import CustomBaseModel, CustomSQLModel
 from unicon_backend.lib.graph import Graph, GraphNode, NodeSocket
-from unicon_backend.lib.helpers import partition
-
-if TYPE_CHECKING:
-    from collections.abc import Callable
 
 logger = logging.getLogger(__name__)
 
@@ -33,17 +31,17 @@ Program = cst.Module
 
 def assemble_fragment(
     fragment: ProgramFragment,
-) -> Sequence[cst.SimpleStatementLine | cst.BaseCompoundStatement]:
+) -> Iterable[cst.SimpleStatementLine | cst.BaseCompoundStatement]:
     """
-    Assemble a program fragement into a list of `cst.Module` statements.
+    Assemble a program fragement into `cst.Module` statements.
 
     We allow for `cst.BaseSmallStatement` to be included in the fragment for convenience during assembly,
     however they are not valid statements in a `cst.Module`. As such, we convert them to `cst.SimpleStatementLine`.
     """
-    return [
+    return (
         cst.SimpleStatementLine([stmt]) if isinstance(stmt, cst.BaseSmallStatement) else stmt
         for stmt in fragment
-    ]
+    )
 
 
 class StepType(str, Enum):
@@ -78,6 +76,8 @@ class StepSocket(NodeSocket):
         - e.g. DATA.<NAME>.<INDEX>
     """
 
+    model_config = ConfigDict(frozen=True)
+
     # The data that the socket holds
     data: PrimitiveData | File | None = None
 
@@ -135,20 +135,23 @@ class OutputSocket(StepSocket):
     """Whether output of the socket should be shown to less priviledged users."""
 
     def model_post_init(self, __context):
-        self.label = self.label or self.id
+        super().model_post_init(__context)
+        self.__dict__["label"] = self.label or self.id
 
 
 Range = tuple[int, int]
 
 
 class Step[SocketT: StepSocket](CustomBaseModel, GraphNode[SocketT], abc.ABC, polymorphic=True):
+    model_config = ConfigDict(frozen=True)
+
     id: int
     type: StepType
 
     _debug: bool = False
 
     # Socket IDs that are used to connect to the subgraph of a `Step`
-    subgraph_socket_ids: ClassVar[set[str]] = set()
+    subgraph_socket_ids: ClassVar[frozenset[str]] = frozenset()
     # The required number of data sockets
     required_control_io: ClassVar[tuple[Range, Range]] = ((-1, 1), (-1, 1))
     # The required number of control sockets
@@ -172,16 +175,11 @@ class Step[SocketT: StepSocket](CustomBaseModel, GraphNode[SocketT], abc.ABC, po
                     # This should never happen
                     return False
 
-        is_data_socket: Callable[[StepSocket], bool] = lambda socket: socket.type == "DATA"
-
-        num_data_in, num_control_in = list(map(len, partition(is_data_socket, self.inputs)))
-        num_data_out, num_control_out = list(map(len, partition(is_data_socket, self.outputs)))
-
-        for got, expected, label in zip(
-            (num_data_in, num_data_out, num_control_in, num_control_out),
-            self.required_data_io + self.required_control_io,
-            ("data input", "data output", "control input", "control output"),
-            strict=True,
+        for got, expected, label in (
+            (len(self.data_in), self.required_data_io[0], "data input"),
+            (len(self.data_out), self.required_data_io[1], "data output"),
+            (len(self.control_in), self.required_control_io[0], "control input"),
+            (len(self.control_out), self.required_control_io[1], "control output"),
         ):
             if not satisfies_required(expected, got):
                 raise ValueError(f"Step {self.id} requires {expected} {label} sockets, found {got}")
@@ -229,45 +227,34 @@ class Step[SocketT: StepSocket](CustomBaseModel, GraphNode[SocketT], abc.ABC, po
             # This can happen if the a step allows an empty subgraph - we defer the check to the step
             return set()
 
-        subgraph_node_ids: set[int] = set()
-        bfs_queue: deque[Step] = deque([subgraph_start_node])
-        while len(bfs_queue):
-            frontier_node = bfs_queue.popleft()
-            if frontier_node.id in subgraph_node_ids:
-                continue
-
-            subgraph_node_ids.add(frontier_node.id)
-            for out_edge in graph.out_edges_index[frontier_node.id]:
-                from_socket_id = out_edge.from_socket_id
-                to_socket_id = out_edge.to_socket_id
-
-                if from_socket_id == "CONTROL.OUT" and to_socket_id == "CONTROL.IN":
-                    bfs_queue.append(graph.node_index[out_edge.to_node_id])
+        control_out_adj, control_in_adj = graph.control_adjacency
 
-            for in_edge in graph.in_edges_index[frontier_node.id]:
-                to_socket_id = in_edge.to_socket_id
-                from_socket_id = in_edge.from_socket_id
-
-                if to_socket_id == "CONTROL.IN" and from_socket_id == "CONTROL.OUT":
-                    bfs_queue.append(graph.node_index[out_edge.from_node_id])
+        subgraph_node_ids: set[int] = {subgraph_start_node.id}
+        dfs_stack: list[int] = [subgraph_start_node.id]
+        while dfs_stack:
+            frontier_node_id = dfs_stack.pop()
+            for node_id in (*control_out_adj[frontier_node_id], *control_in_adj[frontier_node_id]):
+                if node_id not in subgraph_node_ids:
+                    subgraph_node_ids.add(node_id)
+                    dfs_stack.append(node_id)
 
         return subgraph_node_ids
 
-    def get_all_subgraph_node_ids(self, graph: "ComputeGraph") -> set[int]:
-        subgraph_node_ids: set[int] = set()
-
-        for socket_id in self.subgraph_socket_ids:
-            subgraph_node_ids |= self.get_subgraph_node_ids(socket_id, graph)
-
-        return subgraph_node_ids
-
-    def run_subgraph(self, subgraph_socket_id: str, graph: "ComputeGraph") -> Program:
-        return graph.run(
-            debug=self._debug, node_ids=self.get_subgraph_node_ids(subgraph_socket_id, graph)
+    def run_subgraph(self, subgraph_socket_id: str, graph: "ComputeGraph") -> ProgramBody:
+        return graph.assemble(
+            debug=self._debug, node_ids=graph.subgraph_node_ids(self, subgraph_socket_id)
         )
 
+    @cached_property
+    def output_variables(self) -> dict[SocketId, ProgramVariable]:
+        """Return a dictionary of output socket id to the program variable holding its value"""
+        return {
+            socket.id: cst.Name(f"var_{self.id}_{socket.id}".replace(".", "_"))
+            for socket in self.outputs
+        }
+
     def get_output_variable(self, output: SocketId) -> ProgramVariable:
-        return cst.Name(f"var_{self.id}_{output}".replace(".", "_"))
+        return self.output_variables[output]
 
     @abc.abstractmethod
     def run(
@@ -279,6 +266,8 @@ class Step[SocketT: StepSocket](CustomBaseModel, GraphNode[SocketT], abc.ABC, po
 
 
 class InputStep(Step[StepSocket]):
+    type: Literal[StepType.INPUT]
+
     required_data_io: ClassVar[tuple[Range, Range]] = ((0, 0), (1, -1))
 
     @model_validator(mode="after")
@@ -289,14 +278,17 @@ class InputStep(Step[StepSocket]):
         return self
 
     def run(self, *_) -> ProgramFragment:
-        def _parse(data: str | int | float | bool) -> cst.BaseExpression:
+        def _parse(data: PrimitiveData) -> cst.BaseExpression:
             # TODO: Better handle of variables vs strings
-            data_repr: str = (
-                repr(data)
-                if not isinstance(data, str)
-                else (f'"{data}"' if not data.startswith("var_") else data)
-            )
-            return cst.parse_expression(data_repr)
+            match data:
+                case bool():
+                    return cst.Name(repr(data))
+                case str() if data.startswith("var_"):
+                    return cst.parse_expression(data)
+                case str():
+                    return cst.SimpleString(json.dumps(data, ensure_ascii=False))
+                case _:
+                    return cst.parse_expression(repr(data))
 
         program = []
         for socket in self.data_out:
@@ -316,8 +308,17 @@ class InputStep(Step[StepSocket]):
 
 
 class OutputStep(Step[OutputSocket]):
+    type: Literal[StepType.OUTPUT]
+
     required_data_io: ClassVar[tuple[Range, Range]] = ((1, -1), (0, 0))
 
+    # NOTE: libcst nodes are immutable, so nodes that are the same for every step are shared as class constants
+    _json_import: ClassVar[cst.Import] = cst.Import([cst.ImportAlias(name=cst.Name("json"))])
+    _print_func: ClassVar[cst.Name] = cst.Name("print")
+    _json_dumps_func: ClassVar[cst.Attribute] = cst.Attribute(
+        value=cst.Name("json"), attr=cst.Name("dumps")
+    )
+
     def run(self, var_inputs: dict[SocketId, ProgramVariable], *_) -> ProgramFragment:
         result_dict = cst.Dict(
             [
@@ -327,17 +328,12 @@ class OutputStep(Step[OutputSocket]):
         )
 
         return [
-            cst.Import([cst.ImportAlias(name=cst.Name("json"))]),
+            self._json_import,
             cst.Expr(
                 cst.Call(
-                    func=cst.Name("print"),
+                    func=self._print_func,
                     args=[
-                        cst.Arg(
-                            cst.Call(
-                                func=cst.Attribute(value=cst.Name("json"), attr=cst.Name("dumps")),
-                                args=[cst.Arg(result_dict)],
-                            )
-                        )
+                        cst.Arg(cst.Call(func=self._json_dumps_func, args=[cst.Arg(result_dict)]))
                     ],
                 )
             ),
@@ -345,19 +341,23 @@ class OutputStep(Step[OutputSocket]):
 
 
 class StringMatchStep(Step[StepSocket]):
+    type: Literal[StepType.STRING_MATCH]
+
     required_data_io: ClassVar[tuple[Range, Range]] = ((2, 2), (1, 1))
 
+    _str_func: ClassVar[cst.Name] = cst.Name("str")
+
     def run(self, var_inputs: dict[SocketId, ProgramVariable], *_) -> ProgramFragment:
         return [
             cst.Assign(
                 targets=[cst.AssignTarget(self.get_output_variable(self.outputs[0].id))],
                 value=cst.Comparison(
-                    left=cst.Call(cst.Name("str"), args=[cst.Arg(var_inputs[self.data_in[0].id])]),
+                    left=cst.Call(self._str_func, args=[cst.Arg(var_inputs[self.data_in[0].id])]),
                     comparisons=[
                         cst.ComparisonTarget(
                             cst.Equal(),
                             cst.Call(
-                                cst.Name("str"), args=[cst.Arg(var_inputs[self.data_in[1].id])]
+                                self._str_func, args=[cst.Arg(var_inputs[self.data_in[1].id])]
                             ),
                         )
                     ],
@@ -372,6 +372,8 @@ class ObjectAccessStep(Step[StepSocket]):
     To use this step, the user must provide the key value to access the dictionary.
     """
 
+    type: Literal[StepType.OBJECT_ACCESS]
+
     required_data_io: ClassVar[tuple[Range, Range]] = ((1, 1), (1, 1))
 
     key: str
@@ -399,6 +401,8 @@ class PyRunFunctionStep(Step[StepSocket]):
     - DATA.IN.FILE: For the `File` object that contains the Python function
     """
 
+    type: Literal[StepType.PY_RUN_FUNCTION]
+
     required_data_io: ClassVar[tuple[Range, Range]] = ((1, -1), (1, 2))
 
     _data_in_file_id: ClassVar[str] = "DATA.IN.FILE"
@@ -408,6 +412,9 @@ class PyRunFunctionStep(Step[StepSocket]):
     allow_error: bool = False
     _data_out_error_id: ClassVar[str] = "DATA.OUT.ERROR"
 
+    _call_function_safe_func: ClassVar[cst.Name] = cst.Name("call_function_safe")
+    _unused_var: ClassVar[cst.Name] = cst.Name("_")
+
     @model_validator(mode="after")
     def check_module_file_input(self) -> Self:
         if not any(socket.label == "FILE" for socket in self.data_in):
@@ -436,15 +443,25 @@ class PyRunFunctionStep(Step[StepSocket]):
 
         return self
 
-    @property
+    @cached_property
     def arg_sockets(self) -> Sequence[StepSocket]:
         sockets = [socket for socket in self.data_in if socket.label.startswith("ARG.")]
         return sorted(sockets, key=lambda socket: int(socket.label.split(".", 2)[1]))
 
-    @property
+    @cached_property
     def kwarg_sockets(self) -> Sequence[StepSocket]:
         return [socket for socket in self.data_in if socket.label.startswith("KWARG.")]
 
+    @cached_property
+    def output_socket(self) -> StepSocket:
+        # There is exactly one data output socket besides the optional error socket
+        return next(socket for socket in self.data_out if socket.id != self._data_out_error_id)
+
+    @cached_property
+    def kwarg_names(self) -> dict[SocketId, str]:
+        """Return a dictionary of keyword argument socket id to the keyword argument name"""
+        return {socket.id: socket.label.split(".", 1)[1] for socket in self.kwarg_sockets}
+
     def run(
         self,
         var_inputs: dict[SocketId, ProgramVariable],
@@ -458,28 +475,30 @@ class PyRunFunctionStep(Step[StepSocket]):
 
         # NOTE: Assume that there can only be one edge connected to the file input socket. This should ideally be validated.
         # NOTE: Assume that the user-provided input is always stored in the `Step` with id = 0
-        is_user_provided_file: bool = [
-            edge
-            for edge in graph.in_edges_index[self.id]
-            if edge.to_socket_id == self._data_in_file_id
-        ][0].from_node_id == 0
+        is_user_provided_file: bool = (
+            next(
+                edge
+                for edge in graph.in_edges_index[self.id]
+                if edge.to_socket_id == self._data_in_file_id
+            ).from_node_id
+            == 0
+        )
 
         # NOTE: Assume that the program file is always a Python file
         module_name_str = program_file.name.split(".py")[0]
 
         func_name = cst.Name(self.function_identifier)
-        args = [cst.Arg(var_inputs[socket.id]) for socket in self.arg_sockets]
-        kwargs = [
-            cst.Arg(var_inputs[socket.id], keyword=cst.Name(socket.label.split(".", 1)[1]))
+        call_args = [cst.Arg(var_inputs[socket.id]) for socket in self.arg_sockets]
+        call_args.extend(
+            cst.Arg(var_inputs[socket.id], keyword=cst.Name(self.kwarg_names[socket.id]))
             for socket in self.kwarg_sockets
-        ]
+        )
 
-        non_error_sockets = [
-            socket for socket in self.data_out if socket.id != self._data_in_file_id
-        ]
-        output_var_name = self.get_output_variable(non_error_sockets[0].id)
+        output_var_name = self.get_output_variable(self.output_socket.id)
         error_var_name = (
-            self.get_output_variable(self._data_out_error_id) if self.allow_error else cst.Name("_")
+            self.get_output_variable(self._data_out_error_id)
+            if self.allow_error
+            else self._unused_var
         )
 
         return (
@@ -491,13 +510,12 @@ class PyRunFunctionStep(Step[StepSocket]):
                         )
                     ],
                     cst.Call(
-                        cst.Name("call_function_safe"),
+                        self._call_function_safe_func,
                         [
                             cst.Arg(cst.SimpleString(repr(module_name_str))),
                             cst.Arg(cst.SimpleString(repr(self.function_identifier))),
                             cst.Arg(cst.Name(repr(self.allow_error))),
-                            *args,
-                            *kwargs,
+                            *call_args,
                         ],
                     ),
                 )
@@ -505,45 +523,44 @@ class PyRunFunctionStep(Step[StepSocket]):
             if is_user_provided_file
             else [
                 cst.ImportFrom(cst.Name(module_name_str), [cst.ImportAlias(func_name)]),
-                cst.Assign([cst.AssignTarget(output_var_name)], cst.Call(func_name, args + kwargs)),
+                cst.Assign([cst.AssignTarget(output_var_name)], cst.Call(func_name, call_args)),
             ]
         )
 
 
 class LoopStep(Step[StepSocket]):
+    type: Literal[StepType.LOOP]
+
     _pred_socket_id: ClassVar[str] = "CONTROL.IN.PREDICATE"
     _body_socket_id: ClassVar[str] = "CONTROL.OUT.BODY"
 
-    subgraph_socket_ids: ClassVar[set[str]] = {_pred_socket_id, _body_socket_id}
+    subgraph_socket_ids: ClassVar[frozenset[str]] = frozenset({_pred_socket_id, _body_socket_id})
     required_control_io: ClassVar[tuple[Range, Range]] = ((1, 2), (1, 2))
     required_data_io: ClassVar[tuple[Range, Range]] = ((0, 0), (0, 0))
 
+    _loop_test: ClassVar[cst.Name] = cst.Name("True")
+    _break_body: ClassVar[cst.SimpleStatementSuite] = cst.SimpleStatementSuite([cst.Break()])
+
     def run(
         self, var_inputs: dict[SocketId, ProgramVariable], _, graph: "ComputeGraph"
     ) -> ProgramFragment:
-        return [
-            cst.While(
-                test=cst.Name("True"),
-                body=cst.IndentedBlock(
-                    [
-                        *self.run_subgraph(self._pred_socket_id, graph).body,
-                        cst.If(
-                            test=var_inputs[self._pred_socket_id],
-                            body=cst.SimpleStatementSuite([cst.Break()]),
-                        ),
-                        *self.run_subgraph(self._body_socket_id, graph).body,
-                    ]
-                ),
-            )
-        ]
+        loop_body: ProgramBody = self.run_subgraph(self._pred_socket_id, graph)
+        loop_body.append(cst.If(test=var_inputs[self._pred_socket_id], body=self._break_body))
+        loop_body.extend(self.run_subgraph(self._body_socket_id, graph))
+
+        return [cst.While(test=self._loop_test, body=cst.IndentedBlock(loop_body))]
 
 
 class IfElseStep(Step[StepSocket]):
+    type: Literal[StepType.IF_ELSE]
+
     _pred_socket_id: ClassVar[str] = "CONTROL.IN.PREDICATE"
     _if_socket_id: ClassVar[str] = "CONTROL.OUT.IF"
     _else_socket_id: ClassVar[str] = "CONTROL.OUT.ELSE"
 
-    subgraph_socket_ids: ClassVar[set[str]] = {_pred_socket_id, _if_socket_id, _else_socket_id}
+    subgraph_socket_ids: ClassVar[frozenset[str]] = frozenset(
+        {_pred_socket_id, _if_socket_id, _else_socket_id}
+    )
     required_control_io: ClassVar[tuple[Range, Range]] = ((1, 2), (2, 3))
     required_data_io: ClassVar[tuple[Range, Range]] = ((0, 0), (0, 0))
 
@@ -551,29 +568,84 @@ class IfElseStep(Step[StepSocket]):
         self, var_inputs: dict[SocketId, ProgramVariable], _, graph: "ComputeGraph"
     ) -> ProgramFragment:
         return [
-            *self.run_subgraph(self._pred_socket_id, graph).body,
+            *self.run_subgraph(self._pred_socket_id, graph),
             cst.If(
                 test=var_inputs[self._pred_socket_id],
-                body=cst.IndentedBlock([*self.run_subgraph(self._if_socket_id, graph).body]),
-                orelse=cst.Else(
-                    cst.IndentedBlock([*self.run_subgraph(self._else_socket_id, graph).body])
-                ),
+                body=cst.IndentedBlock(self.run_subgraph(self._if_socket_id, graph)),
+                orelse=cst.Else(cst.IndentedBlock(self.run_subgraph(self._else_socket_id, graph))),
             ),
         ]
 
 
-StepClasses = (
+StepClasses = Annotated[
     OutputStep
     | InputStep
     | PyRunFunctionStep
     | LoopStep
     | IfElseStep
     | StringMatchStep
-    | ObjectAccessStep
-)
+    | ObjectAccessStep,
+    Field(discriminator="type"),
+]
 
 
 class ComputeGraph(Graph[StepClasses]):
+    # Memoized subgraph node ids, keyed by (step id, subgraph socket id)
+    _subgraph_node_ids_cache: dict[tuple[int, SocketId], frozenset[int]] = PrivateAttr(
+        default_factory=dict
+    )
+    # Memoized union of all subgraph node ids of a step, keyed by step id
+    _all_subgraph_node_ids_cache: dict[int, frozenset[int]] = PrivateAttr(default_factory=dict)
+
+    @cached_property
+    def control_adjacency(self) -> tuple[defaultdict[int, list[int]], defaultdict[int, list[int]]]:
+        """
+        Return the adjacency of control flow (`CONTROL.OUT` -> `CONTROL.IN`) edges as a pair of dictionaries:
+        node id to successor node ids, and node id to predecessor node ids.
+        """
+        control_out_adj: defaultdict[int, list[int]] = defaultdict(list)
+        control_in_adj: defaultdict[int, list[int]] = defaultdict(list)
+        for edge in self.edges:
+            if edge.from_socket_id == "CONTROL.OUT" and edge.to_socket_id == "CONTROL.IN":
+                control_out_adj[edge.from_node_id].append(edge.to_node_id)
+                control_in_adj[edge.to_node_id].append(edge.from_node_id)
+        return control_out_adj, control_in_adj
+
+    @cached_property
+    def full_topological_order(self) -> list[StepClasses] | None:
+        """
+        Return the topological order of all nodes in the graph, or None if the graph has a cycle.
+
+        Any topological order of the graph is also valid for every subset of its nodes, so orders for
+        (nested) assembly can be derived by filtering this instead of sorting again.
+        NOTE: Loops can form a cycle across their predicate and body, which is only broken once their
+        subgraphs are excluded. In that case, we fall back to sorting each subset.
+        """
+        try:
+            return self.topological_sort()
+        except ValueError:
+            return None
+
+    def subgraph_node_ids(self, step: Step, subgraph_socket_id: str) -> frozenset[int]:
+        """
+        Return the ids of the nodes in the subgraph connected to a subgraph socket of a step.
+        Subgraphs are memoized, as nested assembly (e.g. of loops and conditionals) queries them repeatedly.
+        """
+        cache_key = (step.id, subgraph_socket_id)
+        if (subgraph_node_ids := self._subgraph_node_ids_cache.get(cache_key)) is None:
+            subgraph_node_ids = frozenset(step.get_subgraph_node_ids(subgraph_socket_id, self))
+            self._subgraph_node_ids_cache[cache_key] = subgraph_node_ids
+        return subgraph_node_ids
+
+    def all_subgraph_node_ids(self, step: Step) -> frozenset[int]:
+        """Return the ids of the nodes in all subgraphs of a step"""
+        if (subgraph_node_ids := self._all_subgraph_node_ids_cache.get(step.id)) is None:
+            subgraph_node_ids = frozenset().union(
+                *(self.subgraph_node_ids(step, socket_id) for socket_id in step.subgraph_socket_ids)
+            )
+            self._all_subgraph_node_ids_cache[step.id] = subgraph_node_ids
+        return subgraph_node_ids
+
     def _create_link_variable(self, from_node: Step, from_socket: str) -> ProgramVariable:
         """
         Create a variable name for the output of a node. The variable name must be unique across all nodes and sockets.
@@ -588,7 +660,7 @@ class ComputeGraph(Graph[StepClasses]):
         self,
         user_input_step: Optional["InputStep"] = None,
         debug: bool = True,
-        node_ids: set[int] | None = None,
+        node_ids: AbstractSet[int] | None = None,
     ) -> Program:
         """
         Run the compute graph with the given user input.
@@ -605,22 +677,43 @@ class ComputeGraph(Graph[StepClasses]):
         if user_input_step is not None:
             self.nodes.append(user_input_step)
 
-        # If node_ids is provided, we exclude all other nodes
-        # This is useful when we want to run only a subset of the compute graph
-        node_ids_to_exclude: set[int] = set()
-        if node_ids is not None:
-            node_ids_to_exclude = set(self.node_index.keys()) - node_ids
+        return hoist_imports(cst.Module(body=self.assemble(debug=debug, node_ids=node_ids)))
+
+    def assemble(self, debug: bool = True, node_ids: AbstractSet[int] | None = None) -> ProgramBody:
+        """
+        Assemble the statements of the compute graph, without wrapping them into a program.
+
+        Args:
+            debug (bool, optional): Whether to include debug statements in the program. Defaults to True.
+            node_ids (set[int], optional): The node ids to assemble. Defaults to None.
 
+        Returns:
+            ProgramBody: The statements that are generated from the compute graph
+        """
+        # If node_ids is provided, only the subgraph induced by these nodes is assembled
+        # This is useful when we want to run only a subset of the compute graph
+        # Only the nodes that are run can own subgraphs that need to be excluded
+        nodes_to_run: Iterable[Step] = (
+            self.nodes if node_ids is None else (self.node_index[node_id] for node_id in node_ids)
+        )
         subgraph_node_ids: set[int] = set()
-        for node in self.nodes:
-            if node.id not in node_ids_to_exclude:
-                subgraph_node_ids |= node.get_all_subgraph_node_ids(self)
+        for node in nodes_to_run:
+            subgraph_node_ids |= self.all_subgraph_node_ids(node)
 
         # We do not consider subgraph nodes when determining the flow order (topological order) of the main compute graph
         # The responsibility of determining the order of subgraph nodes is deferred to the step itself
-        topological_order: list[StepClasses] = self.topological_sort(
-            subgraph_node_ids | node_ids_to_exclude
-        )
+        topological_order: list[StepClasses]
+        if self.full_topological_order is None:
+            topological_order = self.topological_sort(subgraph_node_ids, node_ids)
+        elif node_ids is None:
+            topological_order = [
+                node for node in self.full_topological_order if node.id not in subgraph_node_ids
+            ]
+        else:
+            working_node_ids: AbstractSet[int] = node_ids - subgraph_node_ids
+            topological_order = [
+                node for node in self.full_topological_order if node.id in working_node_ids
+            ]
 
         program_body: ProgramBody = []
         for node in topological_order:
@@ -634,29 +727,24 @@ class ComputeGraph(Graph[StepClasses]):
             for in_edge in self.in_edges_index[node.id]:
                 in_node: Step = self.node_index[in_edge.from_node_id]
 
-                # Find the socket that the link is connected to
-                for socket in filter(lambda socket: socket.id == in_edge.to_socket_id, node.inputs):
-                    in_node_sockets = [
-                        socket for socket in in_node.outputs if socket.id == in_edge.from_socket_id
-                    ]
-                    assert len(in_node_sockets) <= 1
-
-                    # If no sockets are connected to this input socket, skip.
-                    if not in_node_sockets:
-                        continue
-
-                    # Get origining node socket from in_node
-                    in_node_socket: StepSocket = in_node_sockets[0]
-
-                    if in_node_socket.data is not None and isinstance(in_node_socket.data, File):
-                        # NOTE: File objects are passed directly to the next step and not serialized as a variable
-                        file_inputs[socket.id] = in_node_socket.data
-                    else:
-                        input_variables[socket.id] = self._create_link_variable(
-                            in_node, in_node_socket.id
-                        )
+                # Find the sockets that the link is connected to
+                # If either end of the link is not a socket of the respective node, skip.
+                socket: StepSocket | None = node.in_socket_index.get(in_edge.to_socket_id)
+                in_node_socket: StepSocket | None = in_node.out_socket_index.get(
+                    in_edge.from_socket_id
+                )
+                if socket is None or in_node_socket is None:
+                    continue
+
+                if in_node_socket.data is not None and isinstance(in_node_socket.data, File):
+                    # NOTE: File objects are passed directly to the next step and not serialized as a variable
+                    file_inputs[socket.id] = in_node_socket.data
+                else:
+                    input_variables[socket.id] = self._create_link_variable(
+                        in_node, in_node_socket.id
+                    )
 
             node._debug = debug
             program_body.extend(assemble_fragment(node.run(input_variables, file_inputs, self)))
 
-        return hoist_imports(cst.Module(body=program_body))
+        return program_body
@@ -1,19 +1,44 @@
 import libcst as cst
-from libcst.codemod import CodemodContext
-from libcst.codemod.visitors import AddImportsVisitor, GatherImportsVisitor, ImportItem
+from libcst.helpers import get_absolute_module_from_package_for_import
 
 
 class RemoveImportsVisitors(cst.CSTTransformer):
     """
     A visitor that removes all import statements from the code.
+
+    The (non-aliased) imports that are removed are gathered in the same traversal, in the same form as
+    `GatherImportsVisitor`: `module_imports` for `import x` and `object_mapping` for `from x import y`.
     """
 
-    def leave_Import(self, _og_node: cst.Import, _updated_node: cst.Import) -> cst.RemovalSentinel:
+    def __init__(self) -> None:
+        super().__init__()
+        self.module_imports: set[str] = set()
+        self.object_mapping: dict[str, set[str]] = {}
+
+    def leave_Import(self, _og_node: cst.Import, updated_node: cst.Import) -> cst.RemovalSentinel:
+        for name in updated_node.names:
+            if name.asname is None:
+                self.module_imports.add(name.evaluated_name)
         return cst.RemoveFromParent()
 
     def leave_ImportFrom(
-        self, _og_node: cst.ImportFrom, _updated_node: cst.ImportFrom
+        self, _og_node: cst.ImportFrom, updated_node: cst.ImportFrom
     ) -> cst.RemovalSentinel:
+        # NOTE: Relative imports cannot be resolved without a package name, so they are dropped
+        module = get_absolute_module_from_package_for_import(None, updated_node)
+        if module is None:
+            return cst.RemoveFromParent()
+
+        if isinstance(updated_node.names, cst.ImportStar):
+            self.object_mapping[module] = {"*"}
+            return cst.RemoveFromParent()
+
+        obj_names = {name.evaluated_name for name in updated_node.names if name.asname is None}
+        # NOTE: A star import already covers every object of the module
+        if obj_names and "*" not in (
+            module_obj_names := self.object_mapping.setdefault(module, set())
+        ):
+            module_obj_names.update(obj_names)
         return cst.RemoveFromParent()
 
 
@@ -22,18 +47,72 @@ def hoist_imports(program: cst.Module) -> cst.Module:
     Hoist all import statements to the top of the program. Additionally, it combines and remove imports to
     prevent duplicate imports.
     """
-    context = CodemodContext()
-    gather_imports_visitor = GatherImportsVisitor(context)
-    program.visit(gather_imports_visitor)
-    removed_imports = program.visit(RemoveImportsVisitors())
-    add_imports_visitor = AddImportsVisitor(
-        context,
-        [ImportItem(module_name_str) for module_name_str in gather_imports_visitor.module_imports]
-        + [
-            ImportItem(module_name_str, obj_name=obj_name_str)
-            for module_name_str, obj_name_strs in gather_imports_visitor.object_mapping.items()
-            for obj_name_str in obj_name_strs
-        ],
+    remove_imports_visitor = RemoveImportsVisitors()
+    removed_imports = program.visit(remove_imports_visitor)
+    return prepend_imports(
+        removed_imports,
+        remove_imports_visitor.module_imports,
+        remove_imports_visitor.object_mapping,
     )
-    program = removed_imports.visit(add_imports_visitor)
-    return program
+
+
+def prepend_imports(
+    program: cst.Module, module_imports: set[str], object_mapping: dict[str, set[str]]
+) -> cst.Module:
+    """
+    Add the given imports to the top of a program that has no imports, in the same layout as `AddImportsVisitor`:
+    after a leading docstring, `__future__` imports first, then `import x` and `from x import y` sorted by module.
+    """
+    if not module_imports and not object_mapping:
+        return program
+
+    def parse_import(import_str: str) -> cst.BaseStatement:
+        return cst.parse_statement(import_str, config=program.config_for_parsing)
+
+    def parse_import_from(module: str) -> cst.BaseStatement:
+        return parse_import(f"from {module} import {', '.join(sorted(object_mapping[module]))}")
+
+    statements = list(program.body)
+    # Never insert an import before an initial docstring or `__strict__` flag
+    num_statements_before_imports = (
+        1 if statements and _is_docstring_or_strict_flag(statements[0]) else 0
+    )
+    statements_before_imports = statements[:num_statements_before_imports]
+    statements_after_imports = statements[num_statements_before_imports:]
+
+    # Make sure there's at least one empty line before the first non-import
+    if statements_after_imports:
+        first_statement = statements_after_imports[0]
+        if (
+            not first_statement.leading_lines
+            or first_statement.leading_lines[0].comment is not None
+        ):
+            statements_after_imports[0] = first_statement.with_changes(
+                leading_lines=(cst.EmptyLine(), *first_statement.leading_lines)
+            )
+
+    return program.with_changes(
+        body=(
+            *statements_before_imports,
+            *(parse_import_from(module) for module in object_mapping if module == "__future__"),
+            *(parse_import(f"import {module}") for module in sorted(module_imports)),
+            *(
+                parse_import_from(module)
+                for module in sorted(object_mapping)
+                if module != "__future__"
+            ),
+            *statements_after_imports,
+        )
+    )
+
+
+def _is_docstring_or_strict_flag(statement: cst.BaseStatement) -> bool:
+    if not isinstance(statement, cst.SimpleStatementLine) or len(statement.body) != 1:
+        return False
+    match statement.body[0]:
+        case cst.Expr(value=cst.SimpleString()):
+            return True
+        case cst.Assign(targets=[cst.AssignTarget(target=cst.Name("__strict__"))]):
+            return True
+        case _:
+            return False
@@ -1,5 +1,6 @@
 import abc
-from asyncio import AbstractEventLoop
+from asyncio import AbstractEventLoop, TimerHandle
+from itertools import takewhile
 from logging import getLogger
 from typing import Literal
 
@@ -15,6 +16,14 @@ logger = getLogger(__name__)
 
 # Reference: https://github.com/pika/pika/blob/main/examples/asynchronous_consumer_example.py
 class AsyncConsumer(abc.ABC):
+    """
+    A consumer that runs `message_callback` for every message of a queue on an asyncio event loop.
+
+    If `slow_callback_duration` is set, the event loop is put in debug mode to log any callback (e.g. a blocking
+    `message_callback`) that takes longer than that many seconds. The loop is shared with the app, so this also
+    applies to the HTTP handlers and the publisher, and debug mode slows all of them down.
+    """
+
     def __init__(
         self,
         amqp_url: str,
@@ -22,6 +31,10 @@ class AsyncConsumer(abc.ABC):
         exchange_type: ExchangeType,
         queue_name: str,
         routing_key: str | None = None,
+        prefetch_count: int = 100,
+        ack_batch_size: int = 32,
+        ack_flush_interval: float = 1.0,
+        slow_callback_duration: float | None = None,
     ):
         self.exchange_name = exchange_name
         self.exchange_type = exchange_type
@@ -30,6 +43,25 @@ class AsyncConsumer(abc.ABC):
         # NOTE: If routing_key is not provided, it will default to the queue_name
         self.routing_key = routing_key or queue_name
 
+        if prefetch_count < 0:
+            raise ValueError("prefetch_count must not be negative")
+        if ack_batch_size < 1:
+            raise ValueError("ack_batch_size must be at least 1")
+
+        # NOTE: Messages in flight use roughly `prefetch_count * average message size` of memory
+        self._prefetch_count = prefetch_count
+
+        # NOTE: Deliveries are acknowledged with `multiple=True` once `ack_batch_size` messages are
+        # pending or `ack_flush_interval` seconds have passed, whichever comes first. The batch is
+        # capped at `prefetch_count` (0 is unlimited), as the broker stops delivering at that point
+        self._ack_batch_size = min(ack_batch_size, prefetch_count or ack_batch_size)
+        self._ack_flush_interval = ack_flush_interval
+        self._last_delivery_tag: int | None = None
+        self._pending_acks: int = 0
+        self._ack_flush_timer: TimerHandle | None = None
+
+        self._slow_callback_duration = slow_callback_duration
+
         self._url = amqp_url
 
         # NOTE: These will be set when the connection is established
@@ -68,6 +100,8 @@ class AsyncConsumer(abc.ABC):
         self.setup_exchange()
 
     def on_channel_closed(self, _channel: Channel, _reason: Exception):
+        # Delivery tags are scoped to the channel, so pending acknowledgements can be dropped
+        self._reset_pending_acks()
         self.close_connection()
 
     def setup_exchange(self):
@@ -97,7 +131,7 @@ class AsyncConsumer(abc.ABC):
 
     def set_qos(self):
         assert self._channel is not None
-        self._channel.basic_qos(prefetch_count=1, callback=self.on_basic_qos_ok)
+        self._channel.basic_qos(prefetch_count=self._prefetch_count, callback=self.on_basic_qos_ok)
 
     def on_basic_qos_ok(self, _frame: Method):
         self.start_consuming()
@@ -120,10 +154,41 @@ class AsyncConsumer(abc.ABC):
         body: bytes,
     ):
         assert self._channel is not None
-        self.message_callback(basic_deliver, properties, body)
-        self._channel.basic_ack(basic_deliver.delivery_tag)
+        delivery_tag = basic_deliver.delivery_tag
+        try:
+            self.message_callback(basic_deliver, properties, body)
+        except Exception:
+            # A batched ack would also cover this delivery, so settle the earlier ones and reject
+            # this one without requeueing, which leaves it to a dead-letter exchange if configured
+            logger.exception(f"Failed to process message with delivery tag {delivery_tag}")
+            self.flush_acks()
+            self._channel.basic_nack(delivery_tag, requeue=False)
+            return
+
+        self._last_delivery_tag = delivery_tag
+        self._pending_acks += 1
+        if self._pending_acks >= self._ack_batch_size:
+            self.flush_acks()
+        elif self._ack_flush_timer is None:
+            assert self._connection is not None
+            self._ack_flush_timer = self._connection.ioloop.call_later(
+                self._ack_flush_interval, self.flush_acks
+            )
+
+    def flush_acks(self):
+        if self._channel is not None and self._last_delivery_tag is not None:
+            self._channel.basic_ack(self._last_delivery_tag, multiple=True)
+        self._reset_pending_acks()
+
+    def _reset_pending_acks(self):
+        if self._ack_flush_timer is not None:
+            self._ack_flush_timer.cancel()
+        self._ack_flush_timer = None
+        self._last_delivery_tag = None
+        self._pending_acks = 0
 
     def stop_consuming(self):
+        self.flush_acks()
         if self._channel:
             self._channel.basic_cancel(self._consumer_tag, callback=self.on_cancel_ok)
 
@@ -146,6 +211,11 @@ class AsyncConsumer(abc.ABC):
             custom_ioloop=event_loop,
         )
 
+        if self._slow_callback_duration is not None:
+            event_loop = self._connection.ioloop
+            event_loop.set_debug(True)
+            event_loop.slow_callback_duration = self._slow_callback_duration
+
     def stop(self):
         if not self._closing:
             self._closing = True
@@ -231,22 +301,27 @@ class AsyncPublisher(abc.ABC):
         self._channel.confirm_delivery(self.on_delivery_confirmation)
 
     def on_delivery_confirmation(self, frame: Method):
-        confirmation_type = frame.method.NAME.split(".")[1].lower()
+        is_ack = isinstance(frame.method, Basic.Ack)
         ack_multiple = frame.method.multiple
         delivery_tag = frame.method.delivery_tag
 
-        self._acked += confirmation_type == "ack"
-        self._nacked += confirmation_type == "nack"
+        if ack_multiple:
+            # NOTE: Delivery tags are published in increasing order, so the confirmed tags are a
+            # prefix of `_deliveries` and we can stop at the first tag past `delivery_tag`
+            confirmed_tags = list(takewhile(lambda tag: tag <= delivery_tag, self._deliveries))
+        else:
+            confirmed_tags = [delivery_tag]
 
-        del self._deliveries[delivery_tag]
+        for confirmed_tag in confirmed_tags:
+            self._deliveries.pop(confirmed_tag, None)
 
-        if ack_multiple:
-            for tmp_tag in filter(lambda tmp_tag: tmp_tag <= delivery_tag, self._deliveries):
-                self._acked += 1
-                del self._deliveries[tmp_tag]
+        if is_ack:
+            self._acked += len(confirmed_tags)
+        else:
+            self._nacked += len(confirmed_tags)
 
     @abc.abstractmethod
-    def publish(self, payload: str, content_type: str): ...
+    def publish(self, payload: str | bytes, content_type: str): ...
 
     def run(self, event_loop: AbstractEventLoop | None = None):
         self._connection = None
@@ -1,24 +1,34 @@
 import re
-from typing import Any
+from typing import Any, ClassVar
 
-from pydantic import BaseModel, model_validator
+from pydantic import BaseModel, GetCoreSchemaHandler, ValidatorFunctionWrapHandler
+from pydantic_core import CoreSchema, core_schema
 from sqlmodel import MetaData, SQLModel
 
+_CAMEL_CASE_BOUNDARY = re.compile(r"(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
+
 
 def _camel_to_snake(name: str) -> str:
-    pattern = re.compile(r"(?<=[a-z])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])")
-    name = pattern.sub("_", name).lower()
-    return name
+    return _CAMEL_CASE_BOUNDARY.sub("_", name).lower()
 
 
 class CustomBaseModel(BaseModel, extra="forbid"):
-    __polymorphic__ = False
-    __subclasses_map__: dict[str, type] = {}
+    __polymorphic__: ClassVar[bool] = False
+    __subclasses_map__: ClassVar[dict[str, type]] = {}
+
+    @classmethod
+    def __get_pydantic_core_schema__(
+        cls, source: type[BaseModel], handler: GetCoreSchemaHandler
+    ) -> CoreSchema:
+        schema = super().__get_pydantic_core_schema__(source, handler)
+        # Only polymorphic models dispatch on the `type` field
+        if not cls.__polymorphic__ or cls.__dict__.get("__pydantic_core_schema__") is schema:
+            return schema
+        return core_schema.no_info_wrap_validator_function(cls.__convert_to_real_type__, schema)
 
-    @model_validator(mode="wrap")
     @classmethod
-    def __convert_to_real_type__(cls, value: Any, handler):
-        if isinstance(value, dict) is False or not cls.__polymorphic__:
+    def __convert_to_real_type__(cls, value: Any, handler: ValidatorFunctionWrapHandler):
+        if not isinstance(value, dict):
             return handler(value)
 
         if (class_full_name := value.get("type", None)) is None:
@@ -1,4 +1,5 @@
 from collections import Counter, defaultdict, deque
+from collections.abc import Set as AbstractSet
 from functools import cached_property
 from itertools import chain
 from typing import Generic, Self, TypeVar
@@ -30,6 +31,16 @@ class GraphNode(BaseModel, Generic[NodeSocketType]):
         """Return a dictionary of socket id to socket object"""
         return {socket.id: socket for socket in chain(self.inputs, self.outputs)}
 
+    @cached_property
+    def in_socket_index(self) -> dict[str, NodeSocketType]:
+        """Return a dictionary of socket id to socket object for input sockets"""
+        return {socket.id: socket for socket in self.inputs}
+
+    @cached_property
+    def out_socket_index(self) -> dict[str, NodeSocketType]:
+        """Return a dictionary of socket id to socket object for output sockets"""
+        return {socket.id: socket for socket in self.outputs}
+
     def get_socket(self, socket_id: str) -> NodeSocketType | None:
         return self.socket_index.get(socket_id)
 
@@ -57,48 +68,72 @@ class Graph(BaseModel, Generic[GraphNodeType]):
         return {node.id: node for node in self.nodes}
 
     @cached_property
-    def out_nodes_index(self) -> defaultdict[int, list[int]]:
-        """Return a dictionary of node id to a list of ids of nodes that are outgoing from the node"""
-        out_nodes_index = defaultdict(list)
+    def _adjacency_indexes(
+        self,
+    ) -> tuple[
+        defaultdict[int, list[int]],
+        defaultdict[int, list[int]],
+        defaultdict[int, list[GraphEdge]],
+        defaultdict[int, list[GraphEdge]],
+    ]:
+        """
+        Return the node and edge adjacency indexes (outgoing nodes, incoming nodes, outgoing edges, incoming edges)
+        """
+        out_nodes_index: defaultdict[int, list[int]] = defaultdict(list)
+        in_nodes_index: defaultdict[int, list[int]] = defaultdict(list)
+        out_edges_index: defaultdict[int, list[GraphEdge]] = defaultdict(list)
+        in_edges_index: defaultdict[int, list[GraphEdge]] = defaultdict(list)
         for edge in self.edges:
             out_nodes_index[edge.from_node_id].append(edge.to_node_id)
-        return out_nodes_index
+            in_nodes_index[edge.to_node_id].append(edge.from_node_id)
+            out_edges_index[edge.from_node_id].append(edge)
+            in_edges_index[edge.to_node_id].append(edge)
+        return out_nodes_index, in_nodes_index, out_edges_index, in_edges_index
 
-    @cached_property
+    @property
+    def out_nodes_index(self) -> defaultdict[int, list[int]]:
+        """Return a dictionary of node id to a list of ids of nodes that are outgoing from the node"""
+        return self._adjacency_indexes[0]
+
+    @property
     def in_nodes_index(self) -> defaultdict[int, list[int]]:
         """Return a dictionary of node id to a list of ids of nodes that are incoming to the node"""
-        in_nodes_index = defaultdict(list)
-        for edge in self.edges:
-            in_nodes_index[edge.to_node_id].append(edge.from_node_id)
-        return in_nodes_index
+        return self._adjacency_indexes[1]
+
+    @cached_property
+    def in_degree_index(self) -> Counter[int]:
+        """Return a dictionary of node id to the number of edges incoming to the node from nodes in the graph"""
+        return Counter(
+            edge.to_node_id for edge in self.edges if edge.from_node_id in self.node_index
+        )
 
     @cached_property
     def edge_index(self) -> dict[int, GraphEdge]:
         """Return a dictionary of edge id to edge object"""
         return {edge.id: edge for edge in self.edges}
 
-    @cached_property
+    @property
     def out_edges_index(self) -> defaultdict[int, list[GraphEdge]]:
         """Return a dictionary of node id to a list of ids of edges that are outgoing from the node"""
-        out_edges_index = defaultdict(list)
-        for edge in self.edges:
-            out_edges_index[edge.from_node_id].append(edge)
-        return out_edges_index
+        return self._adjacency_indexes[2]
 
-    @cached_property
+    @property
     def in_edges_index(self) -> defaultdict[int, list[GraphEdge]]:
         """Return a dictionary of node id to a list of ids of edges that are incoming to the node"""
-        in_edges_index = defaultdict(list)
-        for edge in self.edges:
-            in_edges_index[edge.to_node_id].append(edge)
-        return in_edges_index
+        return self._adjacency_indexes[3]
 
-    def topological_sort(self, ignored_node_ids: set[int] | None = None) -> list[GraphNodeType]:
+    def topological_sort(
+        self,
+        ignored_node_ids: AbstractSet[int] | None = None,
+        node_ids: AbstractSet[int] | None = None,
+    ) -> list[GraphNodeType]:
         """
         Perform topological sort on the graph
 
         Args:
             ignored_node_ids (set[int]): A set of node ids to ignore
+            node_ids (set[int], optional): The node ids to sort, i.e. sort the subgraph induced by these nodes.
+                Defaults to all nodes of the graph.
 
         Returns:
             list[GraphNodeType]: A list of nodes in topological order
@@ -106,15 +141,24 @@ class Graph(BaseModel, Generic[GraphNodeType]):
         Raises:
             ValueError: If the graph has a cycle
         """
-        # NOTE: These nodes will be ignored during topological sort
-        ignored_node_ids = ignored_node_ids or set()
-        working_node_ids = set(self.node_index.keys()) - ignored_node_ids
+        working_node_ids = (self.node_index.keys() if node_ids is None else node_ids) - (
+            ignored_node_ids or set()
+        )
 
-        in_degrees: dict[int, int] = defaultdict(int)
+        in_degrees: dict[int, int] = {}
         node_id_queue: deque[int] = deque(maxlen=len(working_node_ids))
 
+        is_whole_graph = node_ids is None and not ignored_node_ids
         for node_id in working_node_ids:
-            in_degrees[node_id] = len(set(self.in_nodes_index.get(node_id, [])) - ignored_node_ids)
+            # NOTE: In-degrees count edges (not distinct nodes) since they are decremented once per outgoing edge
+            in_degrees[node_id] = (
+                self.in_degree_index[node_id]
+                if is_whole_graph
+                else sum(
+                    in_node_id in working_node_ids
+                    for in_node_id in self.in_nodes_index.get(node_id, [])
+                )
+            )
             if in_degrees[node_id] == 0:
                 node_id_queue.append(node_id)
 
@@ -124,7 +168,7 @@ class Graph(BaseModel, Generic[GraphNodeType]):
             topo_order_node_ids.append(curr_node_id)
 
             for to_node_id in self.out_nodes_index.get(curr_node_id, []):
-                if to_node_id in ignored_node_ids:
+                if to_node_id not in working_node_ids:
                     continue
 
                 in_degrees[to_node_id] -= 1
@@ -8,7 +8,13 @@ from pika.exchange_type import ExchangeType
 from pika.spec import Basic
 from sqlmodel import func, select
 
-from unicon_backend.constants import EXCHANGE_NAME, RABBITMQ_URL, RESULT_QUEUE_NAME
+from unicon_backend.constants import (
+    AMQP_SLOW_CALLBACK_DURATION,
+    EXCHANGE_NAME,
+    RABBITMQ_URL,
+    RESULT_QUEUE_NAME,
+    RESULT_QUEUE_PREFETCH_COUNT,
+)
 from unicon_backend.database import SessionLocal
 from unicon_backend.evaluator.tasks.programming.base import (
     ProgrammingTask,
@@ -29,7 +35,14 @@ logger = logging.getLogger(__name__)
 
 class TaskResultsConsumer(AsyncConsumer):
     def __init__(self):
-        super().__init__(RABBITMQ_URL, EXCHANGE_NAME, ExchangeType.topic, RESULT_QUEUE_NAME)
+        super().__init__(
+            RABBITMQ_URL,
+            EXCHANGE_NAME,
+            ExchangeType.topic,
+            RESULT_QUEUE_NAME,
+            prefetch_count=RESULT_QUEUE_PREFETCH_COUNT,
+            slow_callback_duration=AMQP_SLOW_CALLBACK_DURATION,
+        )
 
     def message_callback(
         self, _basic_deliver: Basic.Deliver, _properties: pika.BasicProperties, body: bytes
@@ -13,7 +13,7 @@ class TaskPublisher(AsyncPublisher):
     def __init__(self):
         super().__init__(RABBITMQ_URL, EXCHANGE_NAME, ExchangeType.topic, TASK_QUEUE_NAME)
 
-    def publish(self, payload: str, content_type: str = "application/json"):
+    def publish(self, payload: str | bytes, content_type: str = "application/json"):
         assert self._channel is not None
 
         self._channel.basic_publish(